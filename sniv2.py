@@ -1,20 +1,30 @@
-from datetime import datetime
+from datetime import datetime, timezone
 import os
+import re
 import time
+import random
 import socket
+import ssl
+import asyncio
 import logging
-import requests
+import aiohttp
+from contextlib import suppress
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, WriteConcern
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     MessageHandler,
     filters,
     CallbackContext,
 )
-from telegram.error import BadRequest
+from telegram.error import BadRequest, TelegramError
 from aiohttp import web
 
 # Load environment variables
@@ -45,42 +55,38 @@ try:
     if not mongodb_uri:
         raise ValueError("MONGODB_URI environment variable not set")
     
-    # Add retryWrites and SSL parameters if not already in URI
-    if "retryWrites" not in mongodb_uri:
-        if "?" in mongodb_uri:
-            mongodb_uri += "&retryWrites=true&w=majority"
-        else:
-            mongodb_uri += "?retryWrites=true&w=majority"
-    
-    # Force SSL/TLS connection
-    if "ssl=true" not in mongodb_uri.lower():
-        if "?" in mongodb_uri:
-            mongodb_uri += "&ssl=true"
-        else:
-            mongodb_uri += "?ssl=true"
+    # Default to majority writes unless the URI sets its own write concern
+    client_options = {}
+    uri_options = {key.lower() for key in parse_qs(urlsplit(mongodb_uri).query)}
+    if 'w' not in uri_options:
+        client_options['w'] = "majority"
     
-    client = MongoClient(
+    client = AsyncIOMotorClient(
         mongodb_uri,
+        **client_options,
+        compressors="zstd,zlib",
         tls=True,
         tlsAllowInvalidCertificates=False,
         connectTimeoutMS=30000,
         socketTimeoutMS=30000,
-        serverSelectionTimeoutMS=30000
+        serverSelectionTimeoutMS=30000,
+        maxPoolSize=50,
+        minPoolSize=5,
+        maxIdleTimeMS=300000,
+        waitQueueTimeoutMS=5000,
+        appname="sni-bot"
     )
     
-    # Test the connection immediately
-    client.admin.command('ping')
-    logger.info("Successfully connected to MongoDB")
-    
 except Exception as e:
-    logger.error(f"Failed to connect to MongoDB: {str(e)}")
+    logger.error(f"Failed to configure MongoDB client: {str(e)}")
     raise
 
 db = client[os.getenv('DATABASE_NAME', '')]
 
 # Collections
 users_collection = db['users']
-scans_collection = db['scans']
+# Scan logs are non-critical, so skip waiting for majority replication
+scans_collection = db['scans'].with_options(write_concern=WriteConcern(w=1))
 sni_collection = db['sni_hosts']
 
 # Webhook configuration
@@ -89,135 +95,338 @@ WEBHOOK_PATH = "/webhook"
 WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', '') + WEBHOOK_PATH
 
+# Scanning configuration
+SCAN_CONCURRENCY = 50
+INTERACTIVE_SCAN_CONCURRENCY = 10
+SCAN_RESULT_SAMPLE_SIZE = 50
+PROBE_TIMEOUT = aiohttp.ClientTimeout(total=5, connect=2)
+TCP_PROBE_TIMEOUT = 1.0
+SSL_CONTEXT = ssl.create_default_context()
+
+# Host part of a line or URL, skipping an optional list bullet and http(s) scheme
+HOST_RE = re.compile(r'^(?:[-*]\s*)?(?:https?://)?([^/\s:?#]+)', re.IGNORECASE)
+
+# Bounded pool for blocking resolver calls, kept off the event loop
+DNS_EXECUTOR = ThreadPoolExecutor(max_workers=20)
+# Warm-up lookups in flight, leaving most resolver threads free for live scans
+DNS_WARMUP_CONCURRENCY = 5
+
+# getaddrinfo errors that mean the name has no address, as opposed to a resolver hiccup
+DNS_NEGATIVE_ERRNOS = {
+    getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA', 'EAI_ADDRFAMILY') if hasattr(socket, name)
+}
+
+# Resolved addresses, least recently used first: host -> (resolved_at, ip or None)
+DNS_CACHE_TTL = 900
+DNS_CACHE_MAXSIZE = 10000
+dns_cache = OrderedDict()
+
+# Shared HTTP session for host probes, created once the event loop is running
+http_session = None
+
+# Process-wide caps on hosts being scanned at once, across all concurrent updates.
+# /scan has its own reserve so single-host scans never queue behind bulk uploads.
+scan_semaphore = None
+interactive_scan_semaphore = None
+
+# Broadcast configuration
+BROADCAST_CONCURRENCY = 25
+BROADCAST_BATCH_SIZE = 500
+BROADCAST_PROGRESS_INTERVAL = 3.0
+
+# /generate replies built from sni_hosts at startup: country -> (hosts_count, response)
+sni_responses = {}
+
+# Users recently confirmed as channel members, oldest check first: user_id -> checked_at
+MEMBERSHIP_CACHE_TTL = 120
+MEMBERSHIP_CACHE_MAXSIZE = 10000
+membership_cache = OrderedDict()
+
 # Load SNI hosts into MongoDB if not already loaded
-def load_sni_hosts():
+async def load_sni_hosts():
     """Load SNI hosts into MongoDB if not already loaded."""
-    if sni_collection.count_documents({}) > 0:
+    if await sni_collection.estimated_document_count() > 0:
         return  # Already loaded
 
-    if os.path.exists("sni.txt"):
-        with open("sni.txt", "r") as file:
-            country = None
-            for line in file:
-                line = line.strip()
-                if line and not line.startswith("#"):  # Ignore empty lines and comments
-                    if line.startswith("Country:"):
-                        country = line.replace("Country:", "").strip()
-                    elif country:
-                        sni_collection.update_one(
-                            {'country': country},
-                            {'$addToSet': {'hosts': line}},
-                            upsert=True
-                        )
-
-# Initialize SNI hosts
-load_sni_hosts()
+    if not os.path.exists("sni.txt"):
+        return
+
+    # country -> hosts, deduplicated in file order (dict keys as an ordered set)
+    hosts_by_country = {}
+    with open("sni.txt", "r") as file:
+        country = None
+        for line in file:
+            line = line.strip()
+            if line and not line.startswith("#"):  # Ignore empty lines and comments
+                if line.startswith("Country:"):
+                    country = line.replace("Country:", "").strip()
+                elif country:
+                    hosts_by_country.setdefault(country, {})[line] = None
+
+    if hosts_by_country:
+        await sni_collection.bulk_write([
+            UpdateOne(
+                {'country': country},
+                {'$addToSet': {'hosts': {'$each': list(hosts)}}},
+                upsert=True
+            )
+            for country, hosts in hosts_by_country.items()
+        ], ordered=False)
 
 # === DATABASE FUNCTIONS ===
-def add_user(user):
+async def ensure_indexes():
+    """Create the indexes used by user, scan and country lookups (idempotent)."""
+    await users_collection.create_index('user_id', unique=True)
+    await scans_collection.create_index([('user_id', 1), ('timestamp', -1)])
+    # Expire scan logs after 30 days
+    await scans_collection.create_index('timestamp', expireAfterSeconds=30 * 24 * 60 * 60)
+    await sni_collection.create_index('country', unique=True)
+
+async def add_user(user):
     """Add user to database if not exists"""
-    users_collection.update_one(
+    await users_collection.update_one(
         {'user_id': user.id},
         {'$set': {
             'username': user.username,
             'first_name': user.first_name,
             'last_name': user.last_name,
-            'join_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            'join_date': datetime.now(timezone.utc)
         }},
         upsert=True
     )
 
-def add_scan(user_id, scan_type, target, results):
+async def add_scan(user_id, scan_type, target, results):
     """Add a scan record to database"""
-    scans_collection.insert_one({
+    await scans_collection.insert_one({
         'user_id': user_id,
         'type': scan_type,
         'target': target,
         'results': results,
-        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        'timestamp': datetime.now(timezone.utc)
     })
 
-def count_users():
+async def count_users():
     """Count the number of unique users"""
-    return users_collection.count_documents({})
+    return await users_collection.count_documents({})
+
+async def load_sni_responses():
+    """Load every country's SNI hosts and prebuild its /generate reply"""
+    sni_responses.clear()
+    async for record in sni_collection.find({}, {'_id': 0, 'country': 1, 'hosts': 1}):
+        hosts = record.get('hosts', [])
+        country = record['country']
+        sni_responses[country] = (
+            len(hosts),
+            f"𝗭𝗲𝗿𝗼 𝗥𝗮𝘁𝗲𝗱 𝗦𝗶𝘁𝗲𝘀 𝗳𝗼𝗿 {country}:\n\n" + "\n".join(hosts)
+        )
 
-def get_sni_hosts(country):
-    """Get SNI hosts for a specific country"""
-    record = sni_collection.find_one({'country': country})
-    return record['hosts'] if record else []
+def get_sni_response(country):
+    """Get the host count and formatted /generate reply for a country"""
+    cached = sni_responses.get(country)
+    if cached and cached[0]:
+        return cached
+    return 0, f"❌ 𝙉𝙤 𝙕𝙚𝙧𝙤 𝙍𝙖𝙩𝙚𝙙 𝙨𝙞𝙩𝙚𝙨 𝙛𝙤𝙪𝙣𝙙 𝙛𝙤𝙧 {country}."
 
 # === FORCE JOIN FUNCTIONALITY ===
+FORCE_JOIN_MARKUP = InlineKeyboardMarkup([
+    [InlineKeyboardButton(f"Join {channel}", url=link)]
+    for channel, link in zip(CONFIG['required_channels'], CONFIG['channel_links'])
+])
+
+async def resolve_channel_ids(app: Application):
+    """Resolve required channel usernames to numeric chat ids once at startup."""
+    channels = CONFIG['required_channels']
+    chats = await asyncio.gather(
+        *[app.bot.get_chat(f"@{channel}") for channel in channels],
+        return_exceptions=True
+    )
+    channel_ids = []
+    for channel, chat in zip(channels, chats):
+        if isinstance(chat, Exception):
+            logger.warning(f"Could not resolve channel @{channel}: {chat}")
+            channel_ids.append(f"@{channel}")
+        else:
+            channel_ids.append(chat.id)
+    app.bot_data['channel_ids'] = channel_ids
+
 async def is_member_of_channels(user_id: int, context: CallbackContext) -> bool:
     """Check if the user is a member of all required channels."""
-    for channel in CONFIG['required_channels']:
-        try:
-            chat_member = await context.bot.get_chat_member(chat_id=f"@{channel}", user_id=user_id)
-            if chat_member.status not in ["member", "administrator", "creator"]:
-                return False
-        except BadRequest:
+    now = time.monotonic()
+    checked_at = membership_cache.get(user_id)
+    if checked_at and now - checked_at < MEMBERSHIP_CACHE_TTL:
+        return True
+
+    channel_ids = context.bot_data.get('channel_ids') or [
+        f"@{channel}" for channel in CONFIG['required_channels']
+    ]
+    results = await asyncio.gather(
+        *[context.bot.get_chat_member(chat_id=chat_id, user_id=user_id) for chat_id in channel_ids],
+        return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, BadRequest):
+            return False
+        if isinstance(result, Exception):
+            raise result
+        if result.status not in ["member", "administrator", "creator"]:
             return False
+
+    # Only cache positive results so users who just joined are not kept waiting
+    membership_cache[user_id] = now
+    membership_cache.move_to_end(user_id)
+    if len(membership_cache) > MEMBERSHIP_CACHE_MAXSIZE:
+        membership_cache.popitem(last=False)
     return True
 
 async def send_force_join_message(update: Update):
     """Send force join message with buttons for all channels."""
-    buttons = [
-        [InlineKeyboardButton(f"Join {CONFIG['required_channels'][i]}", url=CONFIG['channel_links'][i])] 
-        for i in range(len(CONFIG['required_channels']))
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    
     await update.message.reply_text(
         "🚨 You must join all required channels to use this bot.\n\n"
         "After joining, type /start again.",
-        reply_markup=reply_markup
+        reply_markup=FORCE_JOIN_MARKUP
     )
 
 # === SCANNING FUNCTIONS ===
-def resolve_dns(host):
-    """Resolve the host to an IP address."""
+def normalize_host(value):
+    """Extract the lowercased host from a line or URL, or return an empty string."""
+    match = HOST_RE.match(value.strip())
+    return match.group(1).lower() if match else ""
+
+def resolve_host(host):
+    """Resolve the host to an IPv4 address, or None if it definitely does not resolve."""
     try:
-        socket.gethostbyname(host)
-        return True
-    except socket.error:
+        return socket.getaddrinfo(host, None, family=socket.AF_INET, type=socket.SOCK_STREAM)[0][4][0]
+    except UnicodeError:  # invalid IDNA label in host
+        return None
+    except socket.gaierror as e:
+        if e.errno in DNS_NEGATIVE_ERRNOS:
+            return None
+        raise
+
+async def resolve_host_cached(host):
+    """Resolve the host off the event loop, reusing results for DNS_CACHE_TTL seconds."""
+    now = time.monotonic()
+    cached = dns_cache.get(host)
+    if cached and now - cached[0] < DNS_CACHE_TTL:
+        dns_cache.move_to_end(host)
+        return cached[1]
+
+    loop = asyncio.get_running_loop()
+    try:
+        ip = await loop.run_in_executor(DNS_EXECUTOR, resolve_host, host)
+    except OSError:
+        # Transient resolver failure (e.g. EAI_AGAIN): report unresolved but don't cache it
+        return None
+    dns_cache[host] = (now, ip)
+    dns_cache.move_to_end(host)
+    if len(dns_cache) > DNS_CACHE_MAXSIZE:
+        dns_cache.popitem(last=False)
+    return ip
+
+async def warm_dns_cache():
+    """Pre-resolve the bundled SNI hosts so early scans hit the DNS cache."""
+    try:
+        hosts = set()
+        async for record in sni_collection.find({}, {'_id': 0, 'hosts': 1}):
+            hosts.update(filter(None, map(normalize_host, record.get('hosts', []))))
+
+        warmup_semaphore = asyncio.Semaphore(DNS_WARMUP_CONCURRENCY)
+
+        async def bounded_resolve(host):
+            async with warmup_semaphore:
+                await resolve_host_cached(host)
+
+        await asyncio.gather(*[bounded_resolve(host) for host in hosts])
+        logger.info(f"Warmed DNS cache with {len(hosts)} hosts")
+    except Exception as e:
+        logger.warning(f"Failed to warm DNS cache: {e}")
+
+async def is_port_open(host, port, timeout=TCP_PROBE_TIMEOUT):
+    """Check if a TCP connection to a host and port can be opened."""
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+    except (asyncio.TimeoutError, OSError):
         return False
+    writer.close()
+    return True
 
-def check_host(host, port):
+async def check_host(host, port, ip=None):
     """Check if a host is reachable on a specific port and measure latency."""
+    # Connect to the pre-resolved IP but keep the hostname for the Host header and TLS SNI
+    address = ip or host
+    if port not in (443, 80):
+        start_time = time.monotonic()
+        is_open = await is_port_open(address, port, timeout=PROBE_TIMEOUT.connect)
+        return is_open, (time.monotonic() - start_time) * 1000
+
+    # Reject closed ports before paying for TLS and HTTP
+    if not await is_port_open(address, port):
+        return False, 0
+
     try:
-        start_time = time.time()
+        start_time = time.monotonic()
         if port == 443:
-            response = requests.get(f"https://{host}", timeout=10)
-            latency = (time.time() - start_time) * 1000
-            return True, latency
-        elif port == 80:
-            response = requests.get(f"http://{host}", timeout=10)
-            latency = (time.time() - start_time) * 1000
-            return True, latency
-        else:
-            socket.setdefaulttimeout(10)
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            start_time = time.time()
-            result = sock.connect_ex((host, port))
-            latency = (time.time() - start_time) * 1000
-            return result == 0, latency
-    except (requests.RequestException, socket.error) as e:
+            # A completed TLS handshake with the host's SNI is enough; no HTTP exchange needed
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(address, port, ssl=SSL_CONTEXT, server_hostname=host),
+                timeout=PROBE_TIMEOUT.total
+            )
+            writer.close()
+            return True, (time.monotonic() - start_time) * 1000
+
+        url = f"http://{address}"
+        request_kwargs = {
+            'headers': {'Host': host},
+            'timeout': PROBE_TIMEOUT,
+            'allow_redirects': False,
+        }
+        async with http_session.head(url, **request_kwargs) as response:
+            status = response.status
+        # Some servers reject HEAD; fall back to GET without reading the body
+        if status == 405:
+            async with http_session.get(url, **request_kwargs):
+                pass
+        latency = (time.monotonic() - start_time) * 1000
+        return True, latency
+    except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
         logging.error(f"Error checking {host}: {e}")
         return False, 0
 
-def check_host_with_retry(host, port, retries=2):
+async def check_host_with_retry(host, port, ip=None, retries=2):
     """Check a host with retries to handle temporary failures."""
     for attempt in range(retries):
-        is_working, latency = check_host(host, port)
+        is_working, latency = await check_host(host, port, ip)
         if is_working:
             return True, latency
-        time.sleep(1)
+        if attempt < retries - 1:
+            # Exponential backoff with jitter: ~0.2 s, 0.4 s, ...
+            await asyncio.sleep(0.2 * (2 ** attempt) + random.random() * 0.1)
     return False, 0
 
+async def probe_host(host, ip=None):
+    """Probe ports 443 and 80 concurrently, returning (working_port, latency)."""
+    (is_working_443, latency_443), (is_working_80, latency_80) = await asyncio.gather(
+        check_host_with_retry(host, 443, ip),
+        check_host_with_retry(host, 80, ip),
+    )
+    if is_working_443:
+        return 443, latency_443
+    if is_working_80:
+        return 80, latency_80
+    return None, 0
+
+async def scan_host(host):
+    """Resolve a host once and probe it by IP, returning (working_port, latency)."""
+    ip = await resolve_host_cached(host)
+    if not ip:
+        return None, 0
+    return await probe_host(host, ip)
+
 # === COMMAND HANDLERS ===
 async def start(update: Update, context: CallbackContext):
     """Handle the /start command."""
     user = update.effective_user
-    add_user(user)
+    await add_user(user)
     
     if not await is_member_of_channels(user.id, context):
         await send_force_join_message(update)
@@ -242,22 +451,20 @@ async def scan_specific_host(update: Update, context: CallbackContext):
         await update.message.reply_text("𝐏𝐥𝐞𝐚𝐬𝐞 𝐩𝐫𝐨𝐯𝐢𝐝𝐞 𝐚 𝐡𝐨𝐬𝐭 𝐭𝐨 𝐬𝐜𝐚𝐧. Example: `/scan www.who.int`")
         return
 
-    host = context.args[0].strip()
-    host = host.replace("http://", "").replace("https://", "").split("/")[0]
+    host = normalize_host(context.args[0])
 
     await update.message.reply_text(f"⏳ 𝚂𝚌𝚊𝚗𝚗𝚒𝚗𝚐 {host}... 𝙿𝚕𝚎𝚊𝚜𝚎 𝚠𝚊𝚒𝚝.")
 
-    is_working_443, latency_443 = check_host_with_retry(host, 443)
-    is_working_80, latency_80 = check_host_with_retry(host, 80)
+    async with interactive_scan_semaphore:
+        port, latency = await scan_host(host)
 
-    if is_working_443 or is_working_80:
-        latency = latency_443 if is_working_443 else latency_80
-        result = f"✅ {host} is working on port {'443' if is_working_443 else '80'} (Latency: {latency:.2f} ms)"
+    if port:
+        result = f"✅ {host} is working on port {port} (Latency: {latency:.2f} ms)"
     else:
         result = f"❌ {host} is NOT working on ports 443 and 80."
 
     # Save scan results
-    add_scan(user.id, "single_host", host, result)
+    await add_scan(user.id, "single_host", host, result)
     await update.message.reply_text(result)
 
 async def handle_document(update: Update, context: CallbackContext):
@@ -270,35 +477,29 @@ async def handle_document(update: Update, context: CallbackContext):
     
     await update.message.reply_text("⏳ 𝚂𝚌𝚊𝚗𝚗𝚒𝚗𝚐 𝚑𝚘𝚜𝚝𝚜... 𝙿𝚕𝚎𝚊𝚜𝚎 𝚠𝚊𝚒𝚝.")
 
-    file = await update.message.document.get_file()
-    file_path = f"{file.file_id}.txt"
-    await file.download_to_drive(file_path)
-    
+    document = update.message.document
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+
+    # Normalize and deduplicate while keeping the order of the upload
+    lines = data.decode("utf-8", errors="ignore").splitlines()
+    hosts = list(dict.fromkeys(host for host in map(normalize_host, lines) if host))
+
+    async def bounded_scan(host):
+        async with scan_semaphore:
+            return await scan_host(host)
+
+    results = await asyncio.gather(*[bounded_scan(host) for host in hosts])
+
     working_hosts = []
     non_working_hosts = []
-    
-    with open(file_path, "r") as f:
-        for line in f:
-            host = line.strip()
-            if not host:
-                continue
-            host = host.replace("http://", "").replace("https://", "").split("/")[0]
-            
-            if not resolve_dns(host):
-                non_working_hosts.append(f"- {host}")
-                continue
-            
-            is_working_443, latency_443 = check_host_with_retry(host, 443)
-            is_working_80, latency_80 = check_host_with_retry(host, 80)
-            
-            if is_working_443 or is_working_80:
-                latency = latency_443 if is_working_443 else latency_80
-                working_hosts.append(f"- {host} (Latency: {latency:.2f} ms)")
-            else:
-                non_working_hosts.append(f"- {host}")
-            
-            time.sleep(1)
-    
+
+    for host, (port, latency) in zip(hosts, results):
+        if port:
+            working_hosts.append(f"- {host} (Latency: {latency:.2f} ms)")
+        else:
+            non_working_hosts.append(f"- {host}")
+
     response = []
     if working_hosts:
         response.append("⭑⭑★✪ 𝗪𝗼𝗿𝗸𝗶𝗻𝗴 𝗛𝗼𝘀𝘁𝘀/𝗦𝗡𝗜 ✪★⭑⭑\n\n")
@@ -307,14 +508,14 @@ async def handle_document(update: Update, context: CallbackContext):
         response.append("\n◉⦿◉ 𝗡𝗼𝗻 𝗪𝗼𝗿𝗸𝗶𝗻𝗴 𝗛𝗼𝘀𝘁𝘀/𝗦𝗡𝗜 ◉⦿◉\n\n")
         response.extend(non_working_hosts)
     
-    # Save scan results
-    add_scan(user.id, "file_upload", file_path, {
-        'working_hosts': working_hosts,
-        'non_working_hosts': non_working_hosts
+    # Save a summary of the scan rather than the full lists to keep documents small
+    await add_scan(user.id, "file_upload", document.file_name or file.file_id, {
+        'working_count': len(working_hosts),
+        'non_working_count': len(non_working_hosts),
+        'sample_working': working_hosts[:SCAN_RESULT_SAMPLE_SIZE]
     })
     
     await update.message.reply_text("\n".join(response))
-    os.remove(file_path)
 
 async def handle_generate_command(update: Update, context: CallbackContext):
     """Provide Zero Rated sites for a given country."""
@@ -331,15 +532,12 @@ async def handle_generate_command(update: Update, context: CallbackContext):
         return
     
     country = user_input.capitalize()
-    hosts = get_sni_hosts(country)
+    hosts_count, response = get_sni_response(country)
     
-    if hosts:
+    if hosts_count:
         await update.message.reply_text(f"🔍 𝚂𝚌𝚊𝚗𝚗𝚒𝚗𝚐 𝚂𝙽𝙸 𝙷𝚘𝚜𝚝𝚜 𝚏𝚛𝚘𝚖 {country}...")
-        response = f"𝗭𝗲𝗿𝗼 𝗥𝗮𝘁𝗲𝗱 𝗦𝗶𝘁𝗲𝘀 𝗳𝗼𝗿 {country}:\n\n" + "\n".join(hosts)
         # Save the query
-        add_scan(user.id, "country_query", country, {'hosts_count': len(hosts)})
-    else:
-        response = f"❌ 𝙉𝙤 𝙕𝙚𝙧𝙤 𝙍𝙖𝙩𝙚𝙙 𝙨𝙞𝙩𝙚𝙨 𝙛𝙤𝙪𝙣𝙙 𝙛𝙤𝙧 {country}."
+        await add_scan(user.id, "country_query", country, {'hosts_count': hosts_count})
     
     await update.message.reply_text(response)
 
@@ -363,34 +561,60 @@ async def broadcast(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ The broadcast message cannot be empty.")
         return
 
-    users = users_collection.find({}, {'user_id': 1})
+    users = users_collection.find({}, {'_id': 0, 'user_id': 1}, batch_size=1000)
     success = 0
     failures = 0
+    total_users = await users_collection.estimated_document_count()
 
     progress_message = await update.message.reply_text(f"📨 Broadcast initiated...\n\n"
-                                                       f"📊 Total recipients: {users_collection.count_documents({})}\n"
+                                                       f"📊 Total recipients: {total_users}\n"
                                                        f"⏳ Status: Processing...\n\n"
                                                        f"[░░░░░░░░░░] 0%")
 
-    total_users = users_collection.count_documents({})
-    update_interval = max(1, total_users // 10)
-
-    for index, user in enumerate(users):
+    processed = 0
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def send_one(user_id):
+        nonlocal success, failures, processed
+        async with semaphore:
+            try:
+                await context.bot.send_message(chat_id=user_id, text=message, parse_mode="Markdown")
+                success += 1
+            except Exception as e:
+                logger.warning(f"Failed to send message to {user_id}: {e}")
+                failures += 1
+        processed += 1
+
+    async def edit_progress():
+        progress = min(100, int(processed / max(total_users, 1) * 100))
+        progress_bar = '█' * (progress // 10) + '░' * (10 - progress // 10)
         try:
-            await context.bot.send_message(chat_id=user['user_id'], text=message, parse_mode="Markdown")
-            success += 1
-        except Exception as e:
-            logger.warning(f"Failed to send message to {user['user_id']}: {e}")
-            failures += 1
-
-        # Update progress periodically
-        if (index + 1) % update_interval == 0 or index + 1 == total_users:
-            progress = int((index + 1) / total_users * 100)
-            progress_bar = '█' * (progress // 10) + '░' * (10 - progress // 10)
             await progress_message.edit_text(f"📨 Broadcast initiated...\n\n"
                                              f"📊 Total recipients: {total_users}\n"
                                              f"⏳ Status: Processing...\n\n"
                                              f"[{progress_bar}] {progress}%")
+        except TelegramError:
+            pass  # Progress display is best-effort (e.g. message not modified)
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+            await edit_progress()
+
+    # Refresh progress on a timer so the send loop never waits on edits
+    progress_task = asyncio.create_task(report_progress())
+    try:
+        batch = []
+        async for user in users:
+            batch.append(asyncio.create_task(send_one(user['user_id'])))
+            if len(batch) >= BROADCAST_BATCH_SIZE:
+                await asyncio.gather(*batch)
+                batch = []
+        if batch:
+            await asyncio.gather(*batch)
+    finally:
+        progress_task.cancel()
+    await edit_progress()
 
     await update.message.reply_text(f"📢 Broadcast completed!\n\n"
                                      f"✅ Sent: {success}\n"
@@ -404,8 +628,8 @@ async def stats(update: Update, context: CallbackContext):
         await update.message.reply_text("❌ You are not authorized to use this command.")
         return
 
-    user_count = count_users()
-    scan_count = scans_collection.count_documents({})
+    user_count = await count_users()
+    scan_count = await scans_collection.count_documents({})
     await update.message.reply_text(
         f"📊 Bot Statistics:\n"
         f"- Total Users: {user_count}\n"
@@ -451,6 +675,46 @@ async def contact_us(update: Update, context: CallbackContext):
 
 
 # === WEBHOOK SETUP ===
+async def on_startup(app: Application):
+    """Connect to MongoDB and create shared resources once the event loop is running."""
+    global http_session, scan_semaphore, interactive_scan_semaphore
+    try:
+        await client.admin.command('ping')
+        logger.info("Successfully connected to MongoDB")
+    except Exception as e:
+        logger.error(f"Failed to connect to MongoDB: {str(e)}")
+        raise
+
+    await ensure_indexes()
+    await load_sni_hosts()
+    await load_sni_responses()
+    await resolve_channel_ids(app)
+
+    scan_semaphore = asyncio.Semaphore(SCAN_CONCURRENCY)
+    interactive_scan_semaphore = asyncio.Semaphore(INTERACTIVE_SCAN_CONCURRENCY)
+    # Only the port-80 HEAD/GET goes through the connector (TLS and TCP probes open raw
+    # sockets), and each host being scanned holds at most one such request at a time
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=SCAN_CONCURRENCY + INTERACTIVE_SCAN_CONCURRENCY)
+    )
+
+    # Resolve known hosts in the background without delaying startup
+    app.bot_data['dns_warmup_task'] = asyncio.create_task(warm_dns_cache())
+
+async def on_shutdown(app: Application):
+    """Release shared resources on shutdown."""
+    # Stop the DNS warm-up before the resources it uses are closed
+    warmup_task = app.bot_data.get('dns_warmup_task')
+    if warmup_task:
+        warmup_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await warmup_task
+
+    if http_session:
+        await http_session.close()
+    client.close()
+    DNS_EXECUTOR.shutdown(wait=False)
+
 async def health_check(request):
     """Health check endpoint"""
     return web.Response(text="OK")
@@ -464,7 +728,17 @@ async def telegram_webhook(request):
 def main():
     """Run the bot"""
     global application
-    application = Application.builder().token(CONFIG['token']).build()
+    application = (
+        Application.builder()
+        .token(CONFIG['token'])
+        # Keep outgoing traffic under Telegram's flood limits (30 messages/second)
+        .rate_limiter(AIORateLimiter(overall_max_rate=28, overall_time_period=1))
+        # Handle updates in parallel instead of one at a time
+        .concurrent_updates(True)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     # Add handlers
     application.add_handler(CommandHandler("start", start))
@@ -482,7 +756,8 @@ def main():
             listen="0.0.0.0",
             port=PORT,
             url_path=WEBHOOK_PATH,
-            webhook_url=WEBHOOK_URL
+            webhook_url=WEBHOOK_URL,
+            max_connections=100
         )
     else:
         application.run_polling()